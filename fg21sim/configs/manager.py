@@ -10,18 +10,20 @@ Configuration manager.
 """
 
 import os
+import re
 import sys
 import logging
 from logging import FileHandler, StreamHandler
 import operator
-from functools import reduce
+from functools import reduce, lru_cache
 from collections import MutableMapping
 import pkg_resources
 import copy
 import shutil
+import hashlib
 
 from configobj import ConfigObj, ConfigObjError, flatten_errors
-from validate import Validator
+from validate import Validator, ValidateError
 import numpy as np
 
 from .checkers import check_configs
@@ -30,6 +32,17 @@ from ..errors import ConfigError
 
 logger = logging.getLogger(__name__)
 
+# Regular expressions to tokenize the plain configuration files,
+# i.e., without quoted or list values; see ``_fast_parse()``.
+_SECTION_RE = re.compile(r"^\s*(\[+)\s*([^\s\[\]'\"#][^\[\]'\"#]*?)\s*(\]+)"
+                         r"\s*(?:#.*)?$")
+_KEYVALUE_RE = re.compile(r"^\s*([^\s\[\]'\"#=][^\[\]'\"#=]*?)\s*=\s*"
+                          r"([^'\",#]*?)\s*(?:#.*)?$")
+
+# Validator shared by all the validations, which also caches the parsed
+# check strings of the specifications.
+_VALIDATOR = Validator()
+
 
 def _flatten_dict(d, sep="/", parent_key=""):
     """
@@ -85,6 +98,233 @@ def _flatten_dict(d, sep="/", parent_key=""):
     return dict(items)
 
 
+def _read_lines(filepath):
+    """
+    Read the lines of the config file.
+
+    Raises
+    ------
+    ConfigError :
+        The config file cannot be read.
+    """
+    try:
+        with open(filepath, encoding="utf-8") as f:
+            return f.read().splitlines()
+    except IOError:
+        raise ConfigError("Cannot read config from '%s'" % filepath)
+
+
+def _fast_parse(lines):
+    """
+    Quickly parse the plain configurations into a nested dictionary,
+    bypassing the much slower line parser of ``ConfigObj``.
+
+    Only the simple ``key = value`` pairs, (nested) section markers,
+    blank lines and comments are supported.  If any other syntax (e.g.,
+    quoted values, list values, duplicate keys) is found, then ``None``
+    is returned and the caller should fall back to ``ConfigObj``.
+
+    Parameters
+    ----------
+    lines : list[str]
+        The lines of the configurations.
+
+    Returns
+    -------
+    config : dict, or None
+        The parsed configurations with all values as strings, which
+        should be further validated against the specifications.
+        ``None`` if the configurations are not plain enough.
+    """
+    if lines and lines[0].startswith("\ufeff"):
+        return None
+    root = {}
+    # Stack of the sections by depth, with the top level being the root
+    stack = [root]
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        m = _SECTION_RE.match(line)
+        if m:
+            depth = len(m.group(1))
+            if depth != len(m.group(3)) or depth > len(stack):
+                return None
+            del stack[depth:]
+            parent, name = stack[-1], m.group(2)
+            if name in parent:
+                return None
+            parent[name] = {}
+            stack.append(parent[name])
+            continue
+        m = _KEYVALUE_RE.match(line)
+        if m is None:
+            return None
+        key, value = m.groups()
+        section = stack[-1]
+        if key in section:
+            return None
+        section[key] = value
+    return root
+
+
+class _ValidationError(ConfigError):
+    """
+    The config failed to pass the validation against the specifications.
+
+    The error message with details is only rendered when it is actually
+    displayed, since the caller may just catch the exception.
+
+    Parameters
+    ----------
+    config : `~configobj.ConfigObj`
+        The validated config.
+    results : dict
+        The validation results returned by ``config.validate()``.
+    """
+    def __init__(self, config, results):
+        super().__init__(config, results)
+
+    def __reduce__(self):
+        # NOTE: Pickle as a plain ``ConfigError`` with the rendered message,
+        #       since the ``ValidateError`` exceptions in the results do
+        #       not round-trip through pickling.
+        return (ConfigError, (str(self),))
+
+    def __str__(self):
+        config, results = self.args
+        msgs = []
+        for (section_list, key, res) in flatten_errors(config, results):
+            if key is not None:
+                section = ", ".join(section_list)
+                if res is False:
+                    msg = 'key "%s" in section "%s" is missing.' % (
+                        key, section)
+                else:
+                    msg = 'key "%s" in section "%s" failed validation: %s' % (
+                        key, section, res)
+            else:
+                msg = 'section "%s" is missing' % ".".join(section_list)
+            msgs.append(msg)
+        return "\n".join(msgs)
+
+
+@lru_cache(maxsize=None)
+def _parse_configspec(key):
+    """
+    Parse the bundled configuration specifications into a ``ConfigObj``.
+
+    Parameters
+    ----------
+    key : tuple[tuple[str, int]]
+        Tuple of ``(path, mtime_ns)`` pairs of the specification files,
+        which is used as the cache key, therefore the specifications are
+        only parsed again if any of the files is modified.
+
+    Returns
+    -------
+    configspec : `~configobj.ConfigObj`
+        The parsed specifications, which is shared by all the
+        ``ConfigManager`` instances and must be treated as *read-only*.
+    """
+    # NOTE: Read the raw bytes and let ``ConfigObj`` decode the lines.
+    lines = []
+    for path, _mtime in key:
+        with open(path, "rb") as f:
+            lines.extend(f.read().splitlines())
+    return ConfigObj(lines, interpolation=False, list_values=False,
+                     _inspec=True, encoding="utf-8")
+
+
+def _compile_configspec(section, section_list=()):
+    """
+    Recursively compile the specifications into a flat validation plan,
+    so that a single config option can be validated directly.
+
+    Parameters
+    ----------
+    section : `~configobj.Section`
+        The (sub)section of the specifications.
+    section_list : tuple[str], optional
+        The names of the parent sections of the above ``section``.
+        NOTE: This parameter is required for the recursion.
+
+    Returns
+    -------
+    plan : dict
+        Mapping the ``/``-separated key of each config option to a tuple
+        of ``(section_list, name, check)``, i.e., the names of its parent
+        sections, the option name, and the check string.
+    """
+    plan = {}
+    for name, check in section.items():
+        if isinstance(check, dict):
+            plan.update(_compile_configspec(check, section_list + (name,)))
+        else:
+            key = "/".join(section_list + (name,))
+            plan[key] = (section_list, name, check)
+    return plan
+
+
+@lru_cache(maxsize=None)
+def _load_validation_plan(key):
+    """
+    Load the validation plan compiled from the specifications, which is
+    cached and shared across ``ConfigManager`` instances.
+
+    Parameters
+    ----------
+    key : tuple[tuple[str, int]]
+        The cache key of the specifications; see ``_parse_configspec()``.
+    """
+    return _compile_configspec(_parse_configspec(key))
+
+
+@lru_cache(maxsize=None)
+def _configspec_path():
+    """
+    Locate the configuration specifications bundled with this package,
+    which only needs to be resolved once.
+    """
+    return pkg_resources.resource_filename(__name__, "config.spec")
+
+
+def _configspec_key():
+    """
+    Get the cache key of the configuration specifications bundled with
+    this package; see ``_parse_configspec()``.
+    """
+    path = _configspec_path()
+    return ((path, os.stat(path).st_mtime_ns),)
+
+
+@lru_cache(maxsize=None)
+def _build_config_default(key):
+    """
+    Build the default configurations from the specifications, which
+    requires to validate every config option to convert its default value.
+
+    Parameters
+    ----------
+    key : tuple[tuple[str, int]]
+        The cache key of the specifications; see ``_parse_configspec()``.
+
+    Returns
+    -------
+    config_default : `~configobj.ConfigObj`
+        The default configurations, which is shared by all the
+        ``ConfigManager`` instances and must be treated as *read-only*.
+    """
+    config = ConfigObj(interpolation=False,
+                       configspec=_parse_configspec(key),
+                       encoding="utf-8")
+    # NOTE: Use the "copy" mode to also copy the comments.
+    results = config.validate(_VALIDATOR, preserve_errors=True, copy=True)
+    if results is not True:
+        raise _ValidationError(config, results)
+    return config
+
+
 class ConfigManager:
     """
     Manage the default configurations with specifications, as well as
@@ -108,6 +348,30 @@ class ConfigManager:
         The current effective configurations.
     _configspec : `~configobj.ConfigObj`
         The configuration specifications bundled with this package.
+    _plan : dict
+        The validation plan compiled from the specifications; see
+        ``_compile_configspec()``.
+    _flat : dict
+        The flattened current configurations (see ``_flatten_dict()``),
+        i.e., mapping the ``/``-separated keys to the config values, which
+        is used by ``self.getn()`` to resolve the keys with a single lookup.
+        It is ``None`` after the configurations are modified (see
+        ``self._invalidate_caches()``), and rebuilt on the next access.
+    _flat_default : dict
+        The flattened default configurations, similar to ``_flat``.
+    _logconf : dict
+        The cached logging configurations prepared by ``self.logging``,
+        or ``None`` if not prepared yet or invalidated.
+    _frequencies : 1D `~numpy.ndarray`
+        The cached frequencies calculated by ``self.frequencies``,
+        or ``None`` if not calculated yet or invalidated.
+    _paths : dict
+        Cache of the paths resolved by ``self.get_path()``, keyed by the
+        ``(key, userconfig)`` pair.
+    _config_digest : bytes
+        The SHA-1 digest of the config last read by ``self.read_config()``,
+        which is reset to ``None`` once the configurations are otherwise
+        modified.  Reading the identical config again is then skipped.
     userconfig : str
         The filename and path to the user-provided configurations.
         NOTE:
@@ -117,9 +381,10 @@ class ConfigManager:
           configs specifying the input templates or data files, therefore
           allow the use of relative path for those config options.
     """
-    # Path to the user provided configuration file, which indicates user
-    # configurations merged if not ``None``.
-    userconfig = None
+    # NOTE: A subclass adding attributes must define its own ``__slots__``.
+    __slots__ = ("userconfig", "_configspec", "_plan", "_config_default",
+                 "_config", "_flat_default", "_flat", "_logconf",
+                 "_frequencies", "_paths", "_config_digest")
 
     def __init__(self, userconfig=None):
         """
@@ -127,15 +392,21 @@ class ConfigManager:
         If the ``userconfig`` provided, the user configurations is also
         loaded, validated, and merged.
         """
-        configspec = pkg_resources.resource_stream(__name__, "config.spec")
-        self._configspec = ConfigObj(configspec, interpolation=False,
-                                     list_values=False, _inspec=True,
-                                     encoding="utf-8")
-        configs_default = ConfigObj(interpolation=False,
-                                    configspec=self._configspec,
-                                    encoding="utf-8")
-        # Keep a copy of the default configurations
-        self._config_default = self._validate(configs_default)
+        key = _configspec_key()
+        # Path to the user provided configuration file, which indicates
+        # user configurations merged if not ``None``.
+        self.userconfig = None
+        self._configspec = _parse_configspec(key)
+        self._plan = _load_validation_plan(key)
+        # NOTE: The default configurations are validated only once, and
+        #       each instance keeps its own copy.
+        self._config_default = copy.deepcopy(_build_config_default(key))
+        self._flat_default = None
+        self._flat = None
+        self._logconf = None
+        self._frequencies = None
+        self._paths = {}
+        self._config_digest = None
         # NOTE: use ``copy.deepcopy``; see also ``self.reset()``.
         self._config = copy.deepcopy(self._config_default)
         if userconfig:
@@ -158,6 +429,7 @@ class ConfigManager:
                 logger.exception(e)
                 raise ConfigError(e)
         self._config.merge(config)
+        self._invalidate_caches()
 
     def read_config(self, config):
         """
@@ -169,7 +441,28 @@ class ConfigManager:
             Input config to be validated and merged.
             This parameter can be the filename of the config file, or a list
             contains the lines of the configs.
+
+        Raises
+        ------
+        ConfigError :
+            The config file cannot be read, or the config is invalid.
         """
+        if isinstance(config, str):
+            config = _read_lines(config)
+        digest = None
+        if isinstance(config, list):
+            try:
+                digest = hashlib.sha1(
+                    "\n".join(config).encode("utf-8")).digest()
+            except TypeError:
+                pass  # e.g., lines of bytes
+            if digest is not None and digest == self._config_digest:
+                logger.info("Skipped config identical to the last loaded")
+                return
+            # Try the fast parser first for the plain configurations
+            parsed = _fast_parse(config)
+            if parsed is not None:
+                config = parsed
         try:
             newconfig = ConfigObj(config, interpolation=False,
                                   configspec=self._configspec,
@@ -178,6 +471,7 @@ class ConfigManager:
             raise ConfigError(e)
         newconfig = self._validate(newconfig)
         self.merge(newconfig)
+        self._config_digest = digest
         logger.info("Loaded additional config")
 
     def read_userconfig(self, userconfig, reset=False):
@@ -201,15 +495,13 @@ class ConfigManager:
         ------
         ConfigError :
             An user configuration file is already loaded but ``reset`` is
-            not allowed.
+            not allowed, or the user configuration file cannot be read.
         """
         userconfig = os.path.expanduser(userconfig)
-        try:
-            config = open(userconfig).read().split("\n")
-        except IOError:
-            raise ConfigError("Cannot read config from '%s'" % userconfig)
+        # NOTE: Read the file before the reset below.
+        config = _read_lines(userconfig)
 
-        if self.userconfig:
+        if self.userconfig is not None:
             if not reset:
                 raise ConfigError("User configurations already loaded " +
                                   "from '%s'" % self.userconfig)
@@ -231,16 +523,38 @@ class ConfigManager:
         * ``ConfigObj(_config_default)`` will lost all comments.
         """
         self._config = copy.deepcopy(self._config_default)
+        self._invalidate_caches()
         self.userconfig = None
         logger.warning("Reset the configurations to the copy of defaults!")
 
+    def _invalidate_caches(self):
+        """
+        Clear the cached values derived from the current configurations,
+        which must be called once the configurations are modified.
+        """
+        self._flat = None
+        self._logconf = None
+        self._frequencies = None
+        self._paths.clear()
+        self._config_digest = None
+
+    def _release_section(self, from_default=False):
+        """
+        Invalidate the cached values since a section of the (default)
+        configurations is handed out, which may be modified in place.
+        """
+        if from_default:
+            self._flat_default = None
+        else:
+            self._invalidate_caches()
+
     def _validate(self, config):
         """
-        Validate the config against the specification using a default
-        validator.  The validated config values are returned if success,
-        otherwise, the ``ConfigError`` raised with details.
+        Validate the config against the specification using the shared
+        default validator.  The validated config values are returned if
+        success, otherwise, the ``ConfigError`` raised with details.
         """
-        validator = Validator()
+        validator = _VALIDATOR
         try:
             # NOTE:
             # Use the "copy" mode, which will copy both the default values
@@ -250,19 +564,7 @@ class ConfigManager:
         except ConfigObjError as e:
             raise ConfigError(e)
         if results is not True:
-            error_msg = ""
-            for (section_list, key, res) in flatten_errors(config, results):
-                if key is not None:
-                    if res is False:
-                        msg = 'key "%s" in section "%s" is missing.'
-                        msg = msg % (key, ", ".join(section_list))
-                    else:
-                        msg = 'key "%s" in section "%s" failed validation: %s'
-                        msg = msg % (key, ", ".join(section_list), res)
-                else:
-                    msg = 'section "%s" is missing' % ".".join(section_list)
-                error_msg += msg + "\n"
-            raise ConfigError(error_msg)
+            raise _ValidationError(config, results)
         return config
 
     def check_all(self, raise_exception=True):
@@ -297,12 +599,24 @@ class ConfigManager:
         return (result, errors)
 
     def get(self, key, fallback=None, from_default=False):
-        """Get config value by key."""
+        """
+        Get config value by key.
+
+        NOTE
+        ----
+        If a section is returned, the cached values derived from the
+        configurations are invalidated, since the section may be modified
+        in place.  However, a retained section should not be modified
+        later, use ``self.setn()`` instead.
+        """
         if from_default:
             config = self._config_default
         else:
             config = self._config
-        return config.get(key, fallback)
+        value = config.get(key, fallback)
+        if isinstance(value, dict):
+            self._release_section(from_default)
+        return value
 
     def getn(self, key, from_default=False):
         """
@@ -326,22 +640,44 @@ class ConfigManager:
         KeyError :
             The input key specifies a non-exist config option.
 
+        NOTE
+        ----
+        The values are resolved from the cached flattened configurations.
+        If a section is requested, it is walked to and not cached, with the
+        cached values invalidated as by ``self.get()``.  Do not modify the
+        returned values in place, use ``self.setn()`` instead.
+
         References
         ----------
         - Stackoverflow: Checking a Dictionary using a dot notation string
           https://stackoverflow.com/q/12414821/4856091
           https://stackoverflow.com/a/12414913/4856091
         """
-        if isinstance(key, str):
-            key = key.split("/")
+        if not isinstance(key, str):
+            key = "/".join(key)
         if from_default:
-            config = self._config_default
+            if self._flat_default is None:
+                self._flat_default = _flatten_dict(self._config_default)
+            config, flat = self._config_default, self._flat_default
         else:
-            config = self._config
+            if self._flat is None:
+                self._flat = _flatten_dict(self._config)
+            config, flat = self._config, self._flat
+        try:
+            return flat[key]
+        except KeyError:
+            pass
+        # Not a leaf config option (e.g., a section), so walk the nested
+        # configurations.
+        value = config
         try:
-            return reduce(operator.getitem, key, config)
+            for k in key.split("/"):
+                value = value[k]
         except (KeyError, TypeError):
-            raise KeyError("%s: invalid key" % "/".join(key))
+            raise KeyError("%s: invalid key" % key)
+        if isinstance(value, dict):
+            self._release_section(from_default)
+        return value
 
     def __getitem__(self, key):
         return self.getn(key)
@@ -387,6 +723,25 @@ class ConfigManager:
         if val_old == value:
             return
 
+        if not isinstance(key, str):
+            key = "/".join(key)
+        if key in self._plan:
+            # Directly validate the single config option, instead of the
+            # whole configurations created by the following way.
+            section_list, name, check = self._plan[key]
+            try:
+                val_new = _VALIDATOR.check(check, value)
+            except ValidateError as e:
+                raise ConfigError(
+                    'key "%s" in section "%s" failed validation: %s' % (
+                        name, ", ".join(section_list), e))
+            d2 = reduce(lambda x, y: {y: x}, reversed(section_list),
+                        {name: val_new})
+            self.merge(d2)
+            logger.info("Set config: {key}: {val_old} -> {val_new}".format(
+                key=key, val_new=val_new, val_old=val_old))
+            return
+
         # Create a nested dictionary from the input key-value pair
         # Credit:
         # * Stackoverflow: Convert a list into a nested dictionary
@@ -443,7 +798,18 @@ class ConfigManager:
         - The beginning ``~`` (tilde) is expanded to user's home directory.
         - The relative path (with respect to the user configuration file)
           is converted to absolute path if ``self.userconfig`` is valid.
+        - The resolved paths are cached until the configurations are
+          modified.
         """
+        if not isinstance(key, str):
+            key = "/".join(key)
+        # NOTE: ``self.userconfig`` may be directly set (e.g., Web UI)
+        cache_key = (key, self.userconfig)
+        try:
+            return self._paths[cache_key]
+        except KeyError:
+            pass
+
         value = self.getn(key)
         if value is None:
             logger.warning("Specified config '%s' is None or not exist" % key)
@@ -456,13 +822,15 @@ class ConfigManager:
             logger.error(msg)
             raise ValueError(msg)
 
-        path = os.path.expanduser(value)
+        path = os.path.expanduser(value) if value[0] == "~" else value
         if not os.path.isabs(path):
             if self.userconfig is not None:
                 path = os.path.join(os.path.dirname(self.userconfig), path)
             else:
                 logger.warning("Cannot convert to absolute path: %s" % path)
-        return os.path.normpath(path)
+        path = os.path.normpath(path)
+        self._paths[cache_key] = path
+        return path
 
     @property
     def foregrounds(self):
@@ -476,7 +844,7 @@ class ConfigManager:
         available : list[str]
             All available foreground components
         """
-        fg = self.get("foregrounds")
+        fg = self._config["foregrounds"]
         avaliable = list(fg.keys())
         enabled = [key for key, value in fg.items() if value]
         return (enabled, avaliable)
@@ -492,14 +860,25 @@ class ConfigManager:
         frequencies : 1D `~numpy.ndarray`
             List of frequencies where to simulate the foreground.
             Unit: [MHz]
+            NOTE: The array is cached until the configurations are modified,
+                  therefore it is made read-only.
         """
+        if self._frequencies is not None:
+            return self._frequencies
+
         if self.getn("frequency/type") == "custom":
             frequencies = np.array(self.getn("frequency/frequencies"))
         else:
             start = self.getn("frequency/start")
             stop = self.getn("frequency/stop")
             step = self.getn("frequency/step")
-            frequencies = np.arange(start, stop+step/2, step)
+            # NOTE: Calculate the number of frequencies first to avoid
+            #       the floating-point drift of ``np.arange()``.
+            #       Also no frequencies if ``stop < start``.
+            num = max(int(round((stop - start) / step)) + 1, 0)
+            frequencies = np.linspace(start, start + step*(num-1), num)
+        frequencies.flags.writeable = False
+        self._frequencies = frequencies
         return frequencies
 
     @property
@@ -507,8 +886,17 @@ class ConfigManager:
         """
         Get and prepare the logging configurations for
         ``logging.basicConfig()`` to initialize the logging module.
+
+        NOTE
+        ----
+        The prepared configurations (including the handlers) are cached
+        until the configurations are modified, and a shallow copy is
+        returned since ``setup_logging()`` may modify it.
         """
-        conf = self.get("logging")
+        if self._logconf is not None:
+            return self._logconf.copy()
+
+        conf = self._config["logging"]
         level = conf["level"].upper()
         if os.environ.get("DEBUG_FG21SIM"):
             print("DEBUG: Force 'DEBUG' logging level", file=sys.stderr)
@@ -533,7 +921,8 @@ class ConfigManager:
             "datefmt": conf["datefmt"],
             "handlers": handlers,
         }
-        return logconf
+        self._logconf = logconf
+        return logconf.copy()
 
     @property
     def cosmology(self):
@@ -541,7 +930,7 @@ class ConfigManager:
         Get the cosmological parameters and organize them as an dictionary
         for initializing a ``Cosmology`` object.
         """
-        conf = self.get("cosmology")
+        conf = self._config["cosmology"]
         parameters = {
             "H0": conf["H0"],
             "Om0": conf["OmegaM0"],